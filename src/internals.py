@@ -1,19 +1,27 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """Internal functions belonging to `opensimplex_loops.py`.
+
+The kernels evaluate `opensimplex.internals._noise4()` element by element
+inside `numba` parallel loops. Evaluating whole rows with NumPy array
+operations instead is not worth it: 4D OpenSimplex selects one of many
+lattice regions per point, so a vectorized version would have to compute all
+branches and mask them, and the temporaries would make it memory-bound.
 """
 __author__ = "Dennis van Gils"
 __authoremail__ = "vangils.dennis@gmail.com"
 __url__ = "https://github.com/Dennis-van-Gils/opensimplex-loops"
 # pylint: disable=invalid-name
 
-from typing import Union
+import math
+from typing import TYPE_CHECKING, Union
 
 import numpy as np
 from opensimplex.internals import _noise4
 
 try:
-    from numba import njit, prange
+    from numba import njit, prange, get_num_threads, set_num_threads, types
+    from numba.extending import overload
 except ImportError:
     prange = range
 
@@ -23,52 +31,71 @@ except ImportError:
 
         return wrapper
 
+    overload = njit
 
-try:
+    def get_num_threads():
+        return 1
+
+    def set_num_threads(n):  # pylint: disable=unused-argument
+        pass
+
+
+if TYPE_CHECKING:
     from numba_progress import ProgressBar
-except ImportError:
-    ProgressBar = None
 
+# Edge length in elements of the square tiles used to traverse the last two
+# axes of the output
+TILE = 64
 
-@njit(
-    cache=True,
-    parallel=True,
-    nogil=True,
-)
-def _polar_loop_rectangle(
-    N_polar: int,
-    N_rect_x: int,
-    N_rect_y: int,
-    step_polar: float,
-    step_rect_x: float,
-    step_rect_y: float,
-    dtype: type,
-    perm: np.ndarray,
-    progress_hook: Union[ProgressBar, None] = None,
-) -> np.ndarray:
-    noise = np.empty((N_polar, N_rect_y, N_rect_x), dtype=dtype)
-    radius = N_polar * step_polar / (2 * np.pi)
-    factor = 2 * np.pi / N_polar
-
-    # Polar loop
-    for idx_t in prange(N_polar):
-        t = idx_t * factor
-        t_cos = radius * np.cos(t)
-        t_sin = radius * np.sin(t)
-
-        # Linear traversal y
-        for idx_y in prange(N_rect_y):
-            y = idx_y * step_rect_y
-
-            # Linear traversal x
-            for idx_x in prange(N_rect_x):
-                x = idx_x * step_rect_x
-                noise[idx_t, idx_y, idx_x] = _noise4(x, y, t_sin, t_cos, perm)
-
-        if progress_hook is not None:
-            progress_hook.update(1)
-
-    return noise
+
+# ------------------------------------------------------------------------------
+#   Float16 storage
+# ------------------------------------------------------------------------------
+# Numba has no `float16` type on the CPU. Float16 output is therefore written
+# into a `uint16` view of the output array, holding the raw float16 bits.
+
+
+@njit(cache=True)
+def _float16_bits(value: float) -> np.uint16:
+    """Returns the IEEE 754 half-precision bits of `value`, rounded to the
+    nearest even. Values beyond the float16 range become +/- infinity.
+    """
+    sign = 0x8000 if value < 0 else 0
+    value = abs(value)
+    if value == 0:
+        return np.uint16(sign)
+    if value >= 65520.0:
+        return np.uint16(sign | 0x7C00)
+
+    mantissa, exponent = math.frexp(value)  # value = mantissa * 2**exponent
+    exponent -= 1
+    if exponent < -14:
+        # Subnormal. Rounding up to 0x400 correctly yields the smallest normal.
+        return np.uint16(sign | int(np.rint(value * 2.0**24)))
+
+    fraction = int(np.rint((mantissa * 2 - 1) * 1024))  # Can round up to 1024
+    return np.uint16(sign | (((exponent + 15) << 10) + fraction))
+
+
+def _encode(value: float, out: np.ndarray):
+    """Returns `value` encoded for storage into `out`. A `uint16` array holds
+    float16 bits, see `_float16_bits()`.
+    """
+    if out.dtype == np.uint16:
+        return np.float16(value).view(np.uint16)
+    return value
+
+
+@overload(_encode)
+def _encode_numba(value, out):  # pylint: disable=unused-argument
+    if out.dtype == types.uint16:
+        return lambda value, out: _float16_bits(value)
+    return lambda value, out: value
+
+
+# ------------------------------------------------------------------------------
+#   Noise kernel
+# ------------------------------------------------------------------------------
 
 
 @njit(
@@ -76,35 +103,58 @@ def _polar_loop_rectangle(
     parallel=True,
     nogil=True,
 )
-def _double_polar_loop(
-    N_polar_1: int,
-    N_polar_2: int,
-    step_polar_1: float,
-    step_polar_2: float,
-    dtype: type,
-    perm: np.ndarray,
-    progress_hook: Union[ProgressBar, None] = None,
-) -> np.ndarray:
-    noise = np.empty((N_polar_2, N_polar_1), dtype=dtype)
-    radius_1 = N_polar_1 * step_polar_1 / (2 * np.pi)
-    radius_2 = N_polar_2 * step_polar_2 / (2 * np.pi)
-    factor_1 = 2 * np.pi / N_polar_1
-    factor_2 = 2 * np.pi / N_polar_2
-
-    # Polar loop 2
-    for idx_2 in prange(N_polar_2):
-        val_2 = idx_2 * factor_2
-        cos_2 = radius_2 * np.cos(val_2)
-        sin_2 = radius_2 * np.sin(val_2)
-
-        # Polar loop 1
-        for idx_1 in prange(N_polar_1):
-            val_1 = idx_1 * factor_1
-            cos_1 = radius_1 * np.cos(val_1)
-            sin_1 = radius_1 * np.sin(val_1)
-            noise[idx_2, idx_1] = _noise4(sin_1, cos_1, sin_2, cos_2, perm)
-
-        if progress_hook is not None:
-            progress_hook.update(1)
-
-    return noise
+def _simplex4d_grid(
+    c0: np.ndarray,
+    c1: np.ndarray,
+    c2: np.ndarray,
+    c3: np.ndarray,
+    axes: tuple,
+    perms: np.ndarray,
+    out: np.ndarray,
+    progress_hook: Union["ProgressBar", None] = None,
+) -> None:
+    """Evaluates 4D OpenSimplex noise over the 4D output grid `out`, indexed
+    as [seed, a, b, c]. The 4 noise coordinates are looked up from the 1D
+    tables `c0` to `c3`, where table `k` is indexed along output axis
+    `axes[k]`. The seed axis selects the permutation table `perms[seed]`.
+
+    The progress hook counts rows, i.e. `out.size // out.shape[3]` in total.
+    """
+    N_seeds, N_a, N_b, N_c = out.shape
+    N_tiles_b = (N_b + TILE - 1) // TILE
+    N_tiles_c = (N_c + TILE - 1) // TILE
+    N_tiles = N_tiles_b * N_tiles_c
+
+    # Flattened loop over seeds, axis a and square tiles of axes b and c. This
+    # keeps all threads busy whatever the shape, and the tiles keep the
+    # coordinate tables and recently visited parts of `perm` in L1 cache.
+    for idx in prange(N_seeds * N_a * N_tiles):
+        idx_sa = idx // N_tiles
+        idx_tile = idx % N_tiles
+        idx_s = idx_sa // N_a
+        idx_a = idx_sa % N_a
+        tile_b = idx_tile // N_tiles_c
+        tile_c = idx_tile % N_tiles_c
+        start_b = tile_b * TILE
+        stop_b = min(start_b + TILE, N_b)
+        start_c = tile_c * TILE
+        stop_c = min(start_c + TILE, N_c)
+        perm = perms[idx_s]
+
+        for idx_b in range(start_b, stop_b):
+            for idx_c in range(start_c, stop_c):
+                grid_idx = (idx_s, idx_a, idx_b, idx_c)
+                out[idx_s, idx_a, idx_b, idx_c] = _encode(
+                    _noise4(
+                        c0[grid_idx[axes[0]]],
+                        c1[grid_idx[axes[1]]],
+                        c2[grid_idx[axes[2]]],
+                        c3[grid_idx[axes[3]]],
+                        perm,
+                    ),
+                    out,
+                )
+
+        # Count the rows of a tile row once, at its last tile
+        if progress_hook is not None and tile_c == N_tiles_c - 1:
+            progress_hook.update(stop_b - start_b)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Internal CUDA functions belonging to `opensimplex_loops.py`.
+
+Each output element is an independent 4D OpenSimplex evaluation, hence every
+CUDA thread computes exactly one element of the noise array.
+
+This backend is not exposed by the public functions yet. It has never been
+compiled nor run on a GPU, and must first be validated against the CPU output
+of all three generators and all supported dtypes.
+"""
+__author__ = "Dennis van Gils"
+__authoremail__ = "vangils.dennis@gmail.com"
+__url__ = "https://github.com/Dennis-van-Gils/opensimplex-loops"
+# pylint: disable=invalid-name
+
+from typing import TYPE_CHECKING, Union
+
+import numpy as np
+from opensimplex.internals import _noise4
+
+try:
+    from numba import cuda
+except ImportError:
+    cuda = None
+
+    def cuda_jit(*args, **kwargs):  # pylint: disable=unused-argument
+        def wrapper(func):
+            return func
+
+        return wrapper
+
+else:
+    cuda_jit = cuda.jit
+
+if TYPE_CHECKING:
+    from numba_progress import ProgressBar
+
+# Threads per block along the last two axes of the output array
+BLOCK_XY = 16
+
+# Maximum number of blocks along the z-dimension of a CUDA grid
+MAX_GRID_Z = 65535
+
+
+def cuda_is_available() -> bool:
+    """Returns True when `numba.cuda` is installed and a CUDA device is found."""
+    return (cuda is not None) and cuda.is_available()
+
+
+def _blocks(N: int, threads: int) -> int:
+    return (N + threads - 1) // threads
+
+
+# ------------------------------------------------------------------------------
+#   Noise kernel, see `internals._simplex4d_grid()`
+# ------------------------------------------------------------------------------
+
+
+@cuda_jit
+def _simplex4d_grid_kernel(c0, c1, c2, c3, axes, perms, noise, offset_sa):
+    idx_c, idx_b, idx_sa = cuda.grid(3)
+    idx_sa += offset_sa
+    N_seeds, N_a, N_b, N_c = noise.shape
+    if idx_sa >= N_seeds * N_a or idx_b >= N_b or idx_c >= N_c:
+        return
+
+    idx_s = idx_sa // N_a
+    idx_a = idx_sa % N_a
+    grid_idx = (idx_s, idx_a, idx_b, idx_c)
+    noise[idx_s, idx_a, idx_b, idx_c] = _noise4(
+        c0[grid_idx[axes[0]]],
+        c1[grid_idx[axes[1]]],
+        c2[grid_idx[axes[2]]],
+        c3[grid_idx[axes[3]]],
+        perms[idx_s],
+    )
+
+
+# ------------------------------------------------------------------------------
+#   Host-side launcher, mirroring the signature in `internals.py`
+# ------------------------------------------------------------------------------
+
+
+def _simplex4d_grid_cuda(
+    c0: np.ndarray,
+    c1: np.ndarray,
+    c2: np.ndarray,
+    c3: np.ndarray,
+    axes: tuple,
+    perms: np.ndarray,
+    out: np.ndarray,
+    progress_hook: Union["ProgressBar", None] = None,
+) -> None:
+    N_seeds, N_a, N_b, N_c = out.shape
+    d_noise = cuda.device_array(out.shape, dtype=out.dtype)
+
+    d_c0 = cuda.to_device(c0)
+    d_c1 = cuda.to_device(c1)
+    d_c2 = cuda.to_device(c2)
+    d_c3 = cuda.to_device(c3)
+    d_perms = cuda.to_device(np.ascontiguousarray(perms))
+
+    # The grid's z-dimension is limited, so launch in chunks along it
+    threads = (BLOCK_XY, BLOCK_XY, 1)
+    N_sa = N_seeds * N_a
+    for offset_sa in range(0, N_sa, MAX_GRID_Z):
+        blocks = (
+            _blocks(N_c, BLOCK_XY),
+            _blocks(N_b, BLOCK_XY),
+            min(MAX_GRID_Z, N_sa - offset_sa),
+        )
+        _simplex4d_grid_kernel[blocks, threads](
+            d_c0, d_c1, d_c2, d_c3, axes, d_perms, d_noise, offset_sa
+        )
+    d_noise.copy_to_host(out)
+
+    if progress_hook is not None:
+        progress_hook.update(N_seeds * N_a * N_b)
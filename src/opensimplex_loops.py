@@ -16,44 +16,212 @@ __date__ = "27-01-2023"
 __version__ = "1.0.0"
 # pylint: disable=invalid-name
 
-from typing import Union
+from typing import Optional, Sequence, Tuple, Union
+from functools import lru_cache
 import time
 
 import numpy as np
 from opensimplex.api import DEFAULT_SEED
 from opensimplex.internals import _init
 
-try:
-    from numba_progress import ProgressBar
-except ImportError:
-    ProgressBar = None
-
 from internals import (
-    _polar_loop_rectangle,
-    _double_polar_loop,
+    get_num_threads,
+    set_num_threads,
+    _simplex4d_grid,
 )
 
 
+@lru_cache(maxsize=32)
+def _cached_init(seed: int):
+    """Cached version of `opensimplex.internals._init()`. Repeated calls with
+    the same seed will reuse the OpenSimplex permutation tables instead of
+    rebuilding them. The returned arrays are marked read-only, because they
+    are shared between calls.
+
+    The permutation table is kept as the `int64` array returned by `_init()`.
+    Storing it as `int16` gives the exact same noise, but no measurable speedup.
+    """
+    perm, perm_grad_index3 = _init(seed)
+    perm.setflags(write=False)
+    perm_grad_index3.setflags(write=False)
+
+    return perm, perm_grad_index3
+
+
+@lru_cache(maxsize=None)
+def _progress_bar_class():
+    """Returns `numba_progress.ProgressBar`, or None when the package is not
+    installed. The import is deferred to the first time a progress bar is
+    actually needed, because `numba_progress` pulls in `tqdm` and possibly
+    `IPython`, which noticeably slows down importing this module.
+    """
+    try:
+        from numba_progress import (  # pylint: disable=import-outside-toplevel
+            ProgressBar,
+        )
+    except ImportError:
+        return None
+
+    return ProgressBar
+
+
+# Output dtypes for which the `numba` kernels get compiled. Numba specializes
+# the kernels on the type of the `out` array, so each dtype results in its own
+# machine code without any dtype branching inside the hot loops.
+SUPPORTED_DTYPES = (
+    np.dtype(np.float16),
+    np.dtype(np.float32),
+    np.dtype(np.double),
+)
+
+
+# Outputs smaller than this number of elements are generated on a single
+# thread, because waking up the thread pool would take longer than the work
+PARALLEL_MIN_SIZE = 10_000
+
+# Full angle of a circle in radians
+TAU = 2 * np.pi
+
+# Outputs smaller than this number of elements are generated so fast that a
+# progress bar would only add overhead
+PROGRESS_BAR_MIN_SIZE = 1_000_000
+
+
+def _resolve_dtype(dtype: Union[type, np.dtype]) -> np.dtype:
+    """Returns `dtype` as a `numpy.dtype`, checked against `SUPPORTED_DTYPES`."""
+    dtype = np.dtype(dtype)
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(
+            f"Unsupported dtype {dtype}. Use one of "
+            f"{', '.join(str(x) for x in SUPPORTED_DTYPES)}."
+        )
+
+    return dtype
+
+
+def _circle_table(N: int, step: float):
+    """Returns the coordinates of `N` equally-spaced points on a circle with a
+    circumference of `N * step`, as two contiguous arrays `(cos, sin)`. Having
+    these precomputed saves the noise kernels from evaluating the trigonometric
+    functions for every single element.
+
+    The tables are kept in double precision on purpose. Single precision
+    coordinates occasionally push a point across an OpenSimplex lattice region
+    boundary, visibly changing the seeded output for a saving of microseconds.
+    """
+    radius = N * step / TAU
+    angle = np.arange(N) * (TAU / N)
+
+    return radius * np.cos(angle), radius * np.sin(angle)
+
+
+def _prepare_out(
+    out: Optional[np.ndarray],
+    shape: tuple,
+    dtype: np.dtype,
+) -> np.ndarray:
+    """Returns a fresh output array, or validates the user-supplied one."""
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+
+    if out.shape != shape:
+        raise ValueError(
+            f"Argument `out` has shape {out.shape}, but {shape} is required."
+        )
+    if out.dtype != dtype:
+        raise ValueError(
+            f"Argument `out` has dtype {out.dtype}, but `dtype` is {dtype}."
+        )
+
+    return out
+
+
+def _kernel_out(out: np.ndarray) -> np.ndarray:
+    """Returns the view of `out` that the noise kernels should write into.
+    Numba has no `float16` type on the CPU, so float16 output is passed to the
+    kernels as a `uint16` view that receives the raw float16 bits.
+    """
+    if out.dtype == np.float16:
+        return out.view(np.uint16)
+
+    return out
+
+
 def progress_bar_wrapper(
     noise_fun: callable,
     noise_kwargs: list,
     verbose: bool = True,
     total: int = 1,
-):
+    n_threads: Optional[int] = None,
+    return_timing: bool = False,
+) -> Optional[dict]:
+    timed = verbose or return_timing
     if verbose:
         print(f"{'Generating noise...':30s}")
+    if timed:
         tick = time.perf_counter()
 
-    if (ProgressBar is None) or (not verbose):
-        out = noise_fun(**noise_kwargs)
-    else:
-        with ProgressBar(total=total, dynamic_ncols=True) as numba_progress:
-            out = noise_fun(**noise_kwargs, progress_hook=numba_progress)
-
+    if n_threads is None and noise_kwargs["out"].size < PARALLEL_MIN_SIZE:
+        n_threads = 1
+
+    if n_threads is not None:
+        prev_n_threads = get_num_threads()
+        set_num_threads(n_threads)
+
+    try:
+        if (
+            (not verbose)
+            or (noise_kwargs["out"].size < PROGRESS_BAR_MIN_SIZE)
+            or (_progress_bar_class() is None)
+        ):
+            noise_fun(**noise_kwargs)
+        else:
+            ProgressBar = _progress_bar_class()
+            with ProgressBar(total=total, dynamic_ncols=True) as numba_progress:
+                noise_fun(**noise_kwargs, progress_hook=numba_progress)
+    finally:
+        if n_threads is not None:
+            set_num_threads(prev_n_threads)
+
+    if not timed:
+        return None
+
+    elapsed = time.perf_counter() - tick
     if verbose:
-        print(f"done in {(time.perf_counter() - tick):.2f} s")
+        print(f"done in {elapsed:.2f} s")
 
-    return out
+    return {"seconds": elapsed} if return_timing else None
+
+
+def precompile(dtypes: tuple = SUPPORTED_DTYPES):
+    """Compiles the `numba` noise kernels for the given output `dtypes`, with
+    and without a progress bar, by running them once on a tiny grid. Because the
+    kernels are decorated with `cache=True` the compiled machine code is stored
+    on disk and reused by later Python sessions, removing the compilation delay
+    on the first call of each of the noise functions.
+    """
+    perm, _ = _cached_init(DEFAULT_SEED)
+    cos, sin = _circle_table(2, 0.1)
+    axes = (3, 3, 2, 2)
+
+    # Calls without a progress bar omit the `progress_hook` argument, which
+    # `numba` types differently from passing an explicit None
+    hook_kwargs = [{}]
+    ProgressBar = _progress_bar_class()
+    if ProgressBar is not None:
+        hook_kwargs.append(
+            {"progress_hook": ProgressBar(total=2, disable=True)}
+        )
+
+    for kwargs in hook_kwargs:
+        for dtype in dtypes:
+            out = _kernel_out(np.empty((1, 1, 2, 2), dtype=dtype))
+            _simplex4d_grid(
+                sin, cos, sin, cos, axes, perm[np.newaxis], out, **kwargs
+            )
+
+        if kwargs:
+            kwargs["progress_hook"].close()
 
 
 def looping_animated_2D_image(
@@ -63,10 +231,14 @@ def looping_animated_2D_image(
     t_step: float = 0.1,
     x_step: float = 0.01,
     y_step: Union[float, None] = None,
-    dtype: type = np.double,
+    dtype: Union[type, np.dtype] = np.float32,
     seed: int = DEFAULT_SEED,
     verbose: bool = True,
-) -> np.ndarray:
+    *,
+    out: Optional[np.ndarray] = None,
+    n_threads: Optional[int] = None,
+    return_timing: bool = False,
+) -> Union[np.ndarray, Tuple[np.ndarray, dict]]:
     """Generates a stack of seamlessly-looping animated 2D raster images drawn
     from 4D OpenSimplex noise.
 
@@ -95,10 +267,13 @@ def looping_animated_2D_image(
             Spatial step in the y-direction. When set to None `y_step` will be
             set equal to `x_step`.
 
-        dtype (`type`, default = `numpy.double`)
-            Return type of the noise array elements. To reduce the memory
-            footprint one can change from the default `numpy.double` to e.g.
-            `numpy.float32`.
+        dtype (`type` | `numpy.dtype`, default = `numpy.float32`)
+            Return type of the noise array elements, either `numpy.float16`,
+            `numpy.float32` or `numpy.double`. Single precision is more than
+            sufficient for noise in the range [-1, 1] and halves the memory
+            footprint compared to `numpy.double`. Half precision halves it once
+            more, e.g. for feeding video encoders or GPU textures. The noise is
+            always computed in double precision and only rounded when stored.
 
         seed (`int`, default = 3)
             Seed value for the OpenSimplex noise
@@ -107,32 +282,135 @@ def looping_animated_2D_image(
             Print 'Generating noise...' to the terminal? If the `numba_progress`
             package is present a progress bar will also be shown.
 
+        out (`numpy.ndarray` | `None`, default = `None`)
+            Array to write the noise into, e.g. a `numpy.memmap` to store large
+            noise arrays on disk instead of in memory. It must have the exact
+            shape of the return value and the same `dtype`. When set to None a
+            new array will be allocated.
+
+        n_threads (`int` | `None`, default = `None`)
+            Number of CPU threads to use for the noise generation. When set to
+            None all threads available to `numba` will be used, except for
+            tiny outputs which are generated on a single thread.
+
+        return_timing (`bool`, default = `False`)
+            Also return the elapsed wall-clock time of the noise generation?
+
     Returns:
         The 2D image stack as 3D array [time, y-pixel, x-pixel] containing the
         OpenSimplex noise values as floating points. The output is garantueed to
         be in the range [-1, 1], but the exact extrema cannot be known a-priori
         and are probably quite smaller than [-1, 1].
+
+        When `return_timing` is True a tuple `(noise, timing)` is returned
+        instead, where `timing` is the dict `{"seconds": elapsed}`.
+    """
+
+    if N_pixels_y is None:
+        N_pixels_y = N_pixels_x
+    if y_step is None:
+        y_step = x_step
+    dtype = _resolve_dtype(dtype)
+    out = _prepare_out(out, (N_frames, N_pixels_y, N_pixels_x), dtype)
+    perm, _ = _cached_init(seed)
+    cos_t, sin_t = _circle_table(N_frames, t_step)
+
+    timing = progress_bar_wrapper(
+        noise_fun=_simplex4d_grid,
+        noise_kwargs={
+            "c0": np.arange(N_pixels_x) * x_step,
+            "c1": np.arange(N_pixels_y) * y_step,
+            "c2": sin_t,
+            "c3": cos_t,
+            "axes": (3, 2, 1, 1),
+            "perms": perm[np.newaxis],
+            "out": _kernel_out(out)[np.newaxis],
+        },
+        verbose=verbose,
+        return_timing=return_timing,
+        n_threads=n_threads,
+        total=N_frames * N_pixels_y,
+    )
+
+    return (out, timing) if return_timing else out
+
+
+def looping_animated_2D_image_batch(
+    seeds: Sequence[int],
+    N_frames: int = 200,
+    N_pixels_x: int = 1000,
+    N_pixels_y: Union[int, None] = None,
+    t_step: float = 0.1,
+    x_step: float = 0.01,
+    y_step: Union[float, None] = None,
+    dtype: Union[type, np.dtype] = np.float32,
+    verbose: bool = True,
+    *,
+    out: Optional[np.ndarray] = None,
+    n_threads: Optional[int] = None,
+    return_timing: bool = False,
+) -> Union[np.ndarray, Tuple[np.ndarray, dict]]:
+    """Same as `looping_animated_2D_image()`, but generates the image stacks
+    for multiple seeds in one go. This is faster than calling
+    `looping_animated_2D_image()` repeatedly, because all seeds are processed
+    by a single parallel `numba` kernel.
+
+    Args:
+        seeds (`Sequence[int]`)
+            Seed values for the OpenSimplex noise, one per image stack
+
+        N_frames, N_pixels_x, N_pixels_y, t_step, x_step, y_step, dtype,
+        verbose, n_threads, return_timing:
+            See `looping_animated_2D_image()`
+
+        out (`numpy.ndarray` | `None`, default = `None`)
+            Array to write the noise into, e.g. a `numpy.memmap` to store large
+            noise arrays on disk instead of in memory. It must have the exact
+            shape of the return value and the same `dtype`. When set to None a
+            new array will be allocated.
+
+    Returns:
+        The 2D image stacks as 4D array [seed, time, y-pixel, x-pixel]
+        containing the OpenSimplex noise values as floating points. Each
+        `[seed]` slice is identical to the output of
+        `looping_animated_2D_image()` for that seed.
+
+        When `return_timing` is True a tuple `(noise, timing)` is returned
+        instead, where `timing` is the dict `{"seconds": elapsed}`.
     """
 
-    perm, _ = _init(seed)
+    if len(seeds) == 0:
+        raise ValueError("Argument `seeds` must contain at least one seed.")
+    if N_pixels_y is None:
+        N_pixels_y = N_pixels_x
+    if y_step is None:
+        y_step = x_step
+    dtype = _resolve_dtype(dtype)
+    out = _prepare_out(
+        out, (len(seeds), N_frames, N_pixels_y, N_pixels_x), dtype
+    )
+    perms = np.stack([_cached_init(seed)[0] for seed in seeds])
+    perms.setflags(write=False)
+    cos_t, sin_t = _circle_table(N_frames, t_step)
 
-    out = progress_bar_wrapper(
-        noise_fun=_polar_loop_rectangle,
+    timing = progress_bar_wrapper(
+        noise_fun=_simplex4d_grid,
         noise_kwargs={
-            "N_polar": N_frames,
-            "N_rect_x": N_pixels_x,
-            "N_rect_y": N_pixels_y if N_pixels_y is not None else N_pixels_x,
-            "step_polar": t_step,
-            "step_rect_x": x_step,
-            "step_rect_y": y_step if y_step is not None else x_step,
-            "dtype": dtype,
-            "perm": perm,
+            "c0": np.arange(N_pixels_x) * x_step,
+            "c1": np.arange(N_pixels_y) * y_step,
+            "c2": sin_t,
+            "c3": cos_t,
+            "axes": (3, 2, 1, 1),
+            "perms": perms,
+            "out": _kernel_out(out),
         },
         verbose=verbose,
-        total=N_frames,
+        return_timing=return_timing,
+        n_threads=n_threads,
+        total=len(seeds) * N_frames * N_pixels_y,
     )
 
-    return out
+    return (out, timing) if return_timing else out
 
 
 def looping_animated_closed_1D_curve(
@@ -140,10 +418,14 @@ def looping_animated_closed_1D_curve(
     N_pixels_x: int = 1000,
     t_step: float = 0.1,
     x_step: float = 0.01,
-    dtype: type = np.double,
+    dtype: Union[type, np.dtype] = np.float32,
     seed: int = DEFAULT_SEED,
     verbose: bool = True,
-) -> np.ndarray:
+    *,
+    out: Optional[np.ndarray] = None,
+    n_threads: Optional[int] = None,
+    return_timing: bool = False,
+) -> Union[np.ndarray, Tuple[np.ndarray, dict]]:
     """Generates a stack of seamlessly-looping animated 1D curves, each curve in
     turn also closing up seamlessly back-to-front, drawn from 4D OpenSimplex
     noise.
@@ -165,10 +447,13 @@ def looping_animated_closed_1D_curve(
         x_step (`float`, default = 0.01)
             Spatial step in the x-direction
 
-        dtype (`type`, default = `numpy.double`)
-            Return type of the noise array elements. To reduce the memory
-            footprint one can change from the default `numpy.double` to e.g.
-            `numpy.float32`.
+        dtype (`type` | `numpy.dtype`, default = `numpy.float32`)
+            Return type of the noise array elements, either `numpy.float16`,
+            `numpy.float32` or `numpy.double`. Single precision is more than
+            sufficient for noise in the range [-1, 1] and halves the memory
+            footprint compared to `numpy.double`. Half precision halves it once
+            more, e.g. for feeding video encoders or GPU textures. The noise is
+            always computed in double precision and only rounded when stored.
 
         seed (`int`, default = 3)
             Seed value for the OpenSimplex noise
@@ -177,30 +462,54 @@ def looping_animated_closed_1D_curve(
             Print 'Generating noise...' to the terminal? If the `numba_progress`
             package is present a progress bar will also be shown.
 
+        out (`numpy.ndarray` | `None`, default = `None`)
+            Array to write the noise into, e.g. a `numpy.memmap` to store large
+            noise arrays on disk instead of in memory. It must have the exact
+            shape of the return value and the same `dtype`. When set to None a
+            new array will be allocated.
+
+        n_threads (`int` | `None`, default = `None`)
+            Number of CPU threads to use for the noise generation. When set to
+            None all threads available to `numba` will be used, except for
+            tiny outputs which are generated on a single thread.
+
+        return_timing (`bool`, default = `False`)
+            Also return the elapsed wall-clock time of the noise generation?
+
     Returns:
         The 1D curve stack as 2D array [time, x-pixel] containing the
         OpenSimplex noise values as floating points. The output is garantueed to
         be in the range [-1, 1], but the exact extrema cannot be known a-priori
         and are probably quite smaller than [-1, 1].
+
+        When `return_timing` is True a tuple `(noise, timing)` is returned
+        instead, where `timing` is the dict `{"seconds": elapsed}`.
     """
 
-    perm, _ = _init(seed)  # The OpenSimplex seed table
+    dtype = _resolve_dtype(dtype)
+    out = _prepare_out(out, (N_frames, N_pixels_x), dtype)
+    perm, _ = _cached_init(seed)  # The OpenSimplex seed table
+    cos_x, sin_x = _circle_table(N_pixels_x, x_step)
+    cos_t, sin_t = _circle_table(N_frames, t_step)
 
-    out = progress_bar_wrapper(
-        noise_fun=_double_polar_loop,
+    timing = progress_bar_wrapper(
+        noise_fun=_simplex4d_grid,
         noise_kwargs={
-            "N_polar_1": N_pixels_x,
-            "N_polar_2": N_frames,
-            "step_polar_1": x_step,
-            "step_polar_2": t_step,
-            "dtype": dtype,
-            "perm": perm,
+            "c0": sin_x,
+            "c1": cos_x,
+            "c2": sin_t,
+            "c3": cos_t,
+            "axes": (3, 3, 2, 2),
+            "perms": perm[np.newaxis],
+            "out": _kernel_out(out)[np.newaxis, np.newaxis],
         },
         verbose=verbose,
+        return_timing=return_timing,
+        n_threads=n_threads,
         total=N_frames,
     )
 
-    return out
+    return (out, timing) if return_timing else out
 
 
 def tileable_2D_image(
@@ -208,10 +517,14 @@ def tileable_2D_image(
     N_pixels_y: Union[int, None] = None,
     x_step: float = 0.01,
     y_step: Union[float, None] = None,
-    dtype: type = np.double,
+    dtype: Union[type, np.dtype] = np.float32,
     seed: int = DEFAULT_SEED,
     verbose: bool = True,
-) -> np.ndarray:
+    *,
+    out: Optional[np.ndarray] = None,
+    n_threads: Optional[int] = None,
+    return_timing: bool = False,
+) -> Union[np.ndarray, Tuple[np.ndarray, dict]]:
     """Generates a seamlessly-tileable 2D raster image drawn from 4D OpenSimplex
     noise.
 
@@ -235,10 +548,13 @@ def tileable_2D_image(
             Spatial step in the y-direction. When set to None `y_step` will be
             set equal to `x_step`.
 
-        dtype (`type`, default = `numpy.double`)
-            Return type of the noise array elements. To reduce the memory
-            footprint one can change from the default `numpy.double` to e.g.
-            `numpy.float32`.
+        dtype (`type` | `numpy.dtype`, default = `numpy.float32`)
+            Return type of the noise array elements, either `numpy.float16`,
+            `numpy.float32` or `numpy.double`. Single precision is more than
+            sufficient for noise in the range [-1, 1] and halves the memory
+            footprint compared to `numpy.double`. Half precision halves it once
+            more, e.g. for feeding video encoders or GPU textures. The noise is
+            always computed in double precision and only rounded when stored.
 
         seed (`int`, default = 3)
             Seed value for the OpenSimplex noise
@@ -247,27 +563,55 @@ def tileable_2D_image(
             Print 'Generating noise...' to the terminal? If the `numba_progress`
             package is present a progress bar will also be shown.
 
+        out (`numpy.ndarray` | `None`, default = `None`)
+            Array to write the noise into, e.g. a `numpy.memmap` to store large
+            noise arrays on disk instead of in memory. It must have the exact
+            shape of the return value and the same `dtype`. When set to None a
+            new array will be allocated.
+
+        n_threads (`int` | `None`, default = `None`)
+            Number of CPU threads to use for the noise generation. When set to
+            None all threads available to `numba` will be used, except for
+            tiny outputs which are generated on a single thread.
+
+        return_timing (`bool`, default = `False`)
+            Also return the elapsed wall-clock time of the noise generation?
+
     Returns:
         The 2D image as 2D array [y-pixel, x-pixel] containing the
         OpenSimplex noise values as floating points. The output is garantueed to
         be in the range [-1, 1], but the exact extrema cannot be known a-priori
         and are probably quite smaller than [-1, 1].
-    """
 
-    perm, _ = _init(seed)
+        When `return_timing` is True a tuple `(noise, timing)` is returned
+        instead, where `timing` is the dict `{"seconds": elapsed}`.
+    """
 
-    out = progress_bar_wrapper(
-        noise_fun=_double_polar_loop,
+    if N_pixels_y is None:
+        N_pixels_y = N_pixels_x
+    if y_step is None:
+        y_step = x_step
+    dtype = _resolve_dtype(dtype)
+    out = _prepare_out(out, (N_pixels_y, N_pixels_x), dtype)
+    perm, _ = _cached_init(seed)
+    cos_x, sin_x = _circle_table(N_pixels_x, x_step)
+    cos_y, sin_y = _circle_table(N_pixels_y, y_step)
+
+    timing = progress_bar_wrapper(
+        noise_fun=_simplex4d_grid,
         noise_kwargs={
-            "N_polar_1": N_pixels_x,
-            "N_polar_2": N_pixels_y if N_pixels_y is not None else N_pixels_x,
-            "step_polar_1": x_step,
-            "step_polar_2": y_step if y_step is not None else x_step,
-            "dtype": dtype,
-            "perm": perm,
+            "c0": sin_x,
+            "c1": cos_x,
+            "c2": sin_y,
+            "c3": cos_y,
+            "axes": (3, 3, 2, 2),
+            "perms": perm[np.newaxis],
+            "out": _kernel_out(out)[np.newaxis, np.newaxis],
         },
         verbose=verbose,
+        return_timing=return_timing,
+        n_threads=n_threads,
         total=N_pixels_y,
     )
 
-    return out
+    return (out, timing) if return_timing else out